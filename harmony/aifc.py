@@ -1,12 +1,23 @@
 import struct
+import sys
+from abc import ABC, abstractmethod
+from array import array
 from dataclasses import dataclass
-from typing import Any, List, Sequence
+from functools import lru_cache
+from typing import List, Sequence
 
 long = s32 = ">i"
 unsigned_long = u32 = ">I"
 short = s16 = ">h"
 unsigned_short = u16 = ">H"
 
+_CHUNK_HEADER = struct.Struct(">4si")
+_COMMON = struct.Struct(">hIh")
+_SOUND_DATA = struct.Struct(">II")
+_VADPCM_CODES = struct.Struct(">HhH")
+_F64 = struct.Struct(">d")
+_F80 = struct.Struct(">HQ")
+
 
 def pstring(data: bytes):
     b_ = bytes([len(data)]) + data + (b"" if len(data) % 2 else b"\0")
@@ -14,10 +25,15 @@ def pstring(data: bytes):
 
 
 def serialize_f80(num):
-    num = float(num)
-    (f64,) = struct.unpack(">Q", struct.pack(">d", num))
+    return _serialize_f64_bits(int.from_bytes(_F64.pack(float(num)), "big"))
+
+
+# Keyed on the raw bits rather than the float, so 0.0 and -0.0 don't share an
+# entry. Only a handful of sample rates ever get written
+@lru_cache(maxsize=16)
+def _serialize_f64_bits(f64: int) -> bytes:
     f64_sign_bit = f64 & 2**63
-    if num == 0.0:
+    if f64 == f64_sign_bit:
         if f64_sign_bit:
             return b"\x80" + b"\0" * 9
         else:
@@ -31,34 +47,57 @@ def serialize_f80(num):
     f80_exponent = (exponent + 0x3FFF) << 64
     f80_mantissa_bits = 2**63 | (f64_mantissa_bits << (63 - 52))
     f80 = f80_sign_bit | f80_exponent | f80_mantissa_bits
-    return struct.pack(">HQ", f80 >> 64, f80 & (2**64 - 1))
+    return _F80.pack(f80 >> 64, f80 & (2**64 - 1))
 
 
 def align(val, al):
     return (val + (al - 1)) & -al
 
 
-class FormAIFCChunk:
-    chunks: List[Any]
+class Chunk(ABC):
+    tp: bytes
+
+    @abstractmethod
+    def size(self) -> int: ...
+
+    @abstractmethod
+    def serialize_payload(self, data: bytearray, offset: int): ...
+
+    def serialize_into(self, data: bytearray, offset: int) -> int:
+        size = self.size()
+        _CHUNK_HEADER.pack_into(data, offset, self.tp, size)
+        self.serialize_payload(data, offset + _CHUNK_HEADER.size)
+        return offset + _CHUNK_HEADER.size + align(size, 2)
+
+    def serialize(self) -> bytearray:
+        data = bytearray(_CHUNK_HEADER.size + align(self.size(), 2))
+        self.serialize_into(data, 0)
+        return data
+
+
+class FormAIFCChunk(Chunk):
+    tp = b"FORM"
+    chunks: List[Chunk]
 
     def __init__(self) -> None:
         super().__init__()
         self.chunks = []
 
-    def serialize(self):
-        blocks = bytearray()
-        blocks += b"AIFC"
-        for chunk in self.chunks:
-            blocks += chunk.serialize()
+    def size(self):
+        return 4 + sum(
+            _CHUNK_HEADER.size + align(chunk.size(), 2) for chunk in self.chunks
+        )
 
-        header = bytearray()
-        header += b"FORM"
-        header += struct.pack(long, len(blocks))
-        return bytes(header + blocks)
+    def serialize_payload(self, data, offset):
+        data[offset : offset + 4] = b"AIFC"
+        offset += 4
+        for chunk in self.chunks:
+            offset = chunk.serialize_into(data, offset)
 
 
 @dataclass
-class CommonChunk:
+class CommonChunk(Chunk):
+    tp = b"COMM"
     num_channels: int  # audio channels */
     num_frames: int  # sample frames = samples/channel */
     sample_size: int  # bits/sample */
@@ -66,62 +105,59 @@ class CommonChunk:
     compression_type: bytes | str
     compression_string: bytes | str
 
-    def serialize(self):
-        data = bytearray()
-        data += struct.pack(short, self.num_channels)
-        data += struct.pack(unsigned_long, self.num_frames)
-        data += struct.pack(short, self.sample_size)
-        data += serialize_f80(self.sample_rate)
-        data += bytes(self.compression_type)
-        data += pstring(self.compression_string)
+    def compression(self):
+        return bytes(self.compression_type) + pstring(self.compression_string)
 
-        header = bytearray()
-        header += b"COMM"
-        header += struct.pack(long, len(data))
+    def size(self):
+        return _COMMON.size + 10 + len(self.compression())
 
-        return header + data
+    def serialize_payload(self, data, offset):
+        _COMMON.pack_into(
+            data, offset, self.num_channels, self.num_frames, self.sample_size
+        )
+        offset += _COMMON.size
+        data[offset : offset + 10] = serialize_f80(self.sample_rate)
+        offset += 10
+        compression = self.compression()
+        data[offset : offset + len(compression)] = compression
 
 
 @dataclass
-class SoundDataChunk:
+class SoundDataChunk(Chunk):
+    tp = b"SSND"
     offset: int
     block_size: int
     soundData: bytes
 
-    def serialize(self):
-        data = bytearray()
-        data += struct.pack(unsigned_long, self.offset)
-        data += struct.pack(unsigned_long, self.block_size)
-        data += self.soundData
-
-        header = bytearray()
-        header += b"SSND"
-        header += struct.pack(long, len(data))
+    def size(self):
+        return _SOUND_DATA.size + len(self.soundData)
 
-        return header + data + (b"" if len(data) % 2 == 0 else b"\0")
+    def serialize_payload(self, data, offset):
+        _SOUND_DATA.pack_into(data, offset, self.offset, self.block_size)
+        offset += _SOUND_DATA.size
+        data[offset : offset + len(self.soundData)] = self.soundData
 
 
 @dataclass
-class VadpcmCodesChunk:
+class VadpcmCodesChunk(Chunk):
+    tp = b"APPL"
     version = 1
     order: int
     nEntries: int
     tableData: Sequence[int]
 
-    def serialize(self):
-        data = bytearray()
-        data += b"stoc"
-        data += pstring(b"VADPCMCODES")
-        data += struct.pack(u16, self.version)
-        data += struct.pack(s16, self.order)
-        data += struct.pack(u16, self.nEntries)
-
-        table_data = b"".join(struct.pack(">h", x) for x in self.tableData)
-        assert len(table_data) == (self.order * self.nEntries * 16)
-        data += table_data
-
-        header = bytearray()
-        header += b"APPL"
-        header += struct.pack(long, len(data))
-
-        return header + data
+    def size(self):
+        return 16 + _VADPCM_CODES.size + 2 * len(self.tableData)
+
+    def serialize_payload(self, data, offset):
+        assert 2 * len(self.tableData) == (self.order * self.nEntries * 16)
+
+        data[offset : offset + 16] = b"stoc" + pstring(b"VADPCMCODES")
+        offset += 16
+        _VADPCM_CODES.pack_into(data, offset, self.version, self.order, self.nEntries)
+        offset += _VADPCM_CODES.size
+        # Copying into an array is a plain memcpy when the table already is one
+        table = array("h", self.tableData)
+        if sys.byteorder == "little":
+            table.byteswap()
+        data[offset : offset + 2 * len(table)] = table
@@ -1,12 +1,21 @@
 from __future__ import annotations
 
-import math
 import struct
+import sys
+from array import array
+from collections import defaultdict, deque
 from dataclasses import dataclass
-from io import SEEK_SET, BytesIO
-from typing import Any, Generic, List, NewType, TypeVar
-
-import rich
+from typing import (
+    Any,
+    DefaultDict,
+    Deque,
+    Dict,
+    Generic,
+    List,
+    NewType,
+    Tuple,
+    TypeVar,
+)
 
 U32 = NewType("U32", int)
 U8 = NewType("U8", int)
@@ -31,21 +40,31 @@ AL_RAW16_WAVE = 1
 T = TypeVar("T")
 
 
-def unpack(fmt: str, io: BytesIO):
-    size = struct.calcsize(fmt)
-    return struct.unpack(fmt, io.read(size))
+_ENVELOPE = struct.Struct(f">{s32}{s32}{s32}{u8}{u8}")
+_KEYMAP = struct.Struct(f">5{u8}1{s8}")
+_ADPCM_BOOK = struct.Struct(f">{s32}{s32}")
+_ADPCM_LOOP = struct.Struct(f">{u32}{u32}{u32}")
+# Includes the waveInfo union, which is always two words wide: loop and book
+# for ADPCM, only loop for raw waves
+_WAVETABLE = struct.Struct(f">{u32}{s32}4{u8}2{u32}")
+_SOUND = struct.Struct(f">{u32}{u32}{u32}{u8}{u8}{u8}")
+_INSTRUMENT = struct.Struct(f">12{u8}{s16}{s16}")
+_BANK = struct.Struct(f">{s16}{u8}{u8}{s32}")
+_BANK_FILE = struct.Struct(f">{s16}{s16}")
 
 
 class Pointer(Generic[T]):
-    def __init__(self, offset: int, reader: Reader) -> None:
+    def __init__(self, offset: int, reader: Reader, item: ReaderItem) -> None:
         self.offset = offset
         self.reader = reader
+        # Holding on to the item skips the offset lookup on every dereference
+        self.item = item
 
     def get(self) -> T:
-        return self.reader.get(self.offset)
+        return self.item.value
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALEnvelope:
     attackTime: ALMicroTime
     decayTime: ALMicroTime
@@ -54,22 +73,21 @@ class ALEnvelope:
     decayVolume: U8
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
+    def unpack(reader: Reader):
         envelope = ALEnvelope()
 
-        format = f">{s32}{s32}{s32}{u8}{u8}"
         [
             envelope.attackTime,
             envelope.decayTime,
             envelope.releaseTime,
             envelope.attackVolume,
             envelope.decayVolume,
-        ] = unpack(format, io)
+        ] = reader.unpack(_ENVELOPE)
 
         return envelope
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALKeyMap:
     velocityMin: U8
     velocityMax: U8
@@ -79,10 +97,9 @@ class ALKeyMap:
     detune: S8
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
+    def unpack(reader: Reader):
         keymap = ALKeyMap()
 
-        format = f">5{u8}1{s8}"
         [
             keymap.velocityMin,
             keymap.velocityMax,
@@ -90,52 +107,47 @@ class ALKeyMap:
             keymap.keyMax,
             keymap.keyBase,
             keymap.detune,
-        ] = unpack(format, io)
+        ] = reader.unpack(_KEYMAP)
 
         return keymap
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALADPCMBook:
     order: S32
     npredictors: S32
-    book: List[S16]
+    book: array[S16]
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
+    def unpack(reader: Reader):
         book = ALADPCMBook()
-        format = f">{s32}{s32}"
-        [book.order, book.npredictors] = unpack(format, io)
+        [book.order, book.npredictors] = reader.unpack(_ADPCM_BOOK)
 
-        book.book = []
-        for i in range(0, 16 * book.order * book.npredictors, 2):
-            # TODO: increment offset
-            book.book.append(unpack(f">{s16}", io)[0])
+        # 8 coefficients per order, per predictor
+        count = 8 * book.order * book.npredictors
+        book.book = reader.unpack_array(s16, count)
 
         return book
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALADPCMloop:
     start: U32
     end: U32
     count: U32
-    state: List[S16]
+    state: array[S16]
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
+    def unpack(reader: Reader):
         loop = ALADPCMloop()
 
-        format = f">{u32}{u32}{u32}"
-        [loop.start, loop.end, loop.count] = unpack(format, io)
-
-        format = f">16{s16}"
-        loop.state = list(unpack(format, io))
+        [loop.start, loop.end, loop.count] = reader.unpack(_ADPCM_LOOP)
+        loop.state = reader.unpack_array(s16, 16)
 
         return loop
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALWaveTable:
     base: U32
     len: S32
@@ -146,9 +158,10 @@ class ALWaveTable:
     loop: Pointer[ALADPCMloop] | None = None
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
-        format = f">{u32}{s32}4{u8}"
+    def unpack(reader: Reader):
         table = ALWaveTable()
+        table.book = None
+        table.loop = None
         [
             table.base,
             table.len,
@@ -156,20 +169,20 @@ class ALWaveTable:
             table.flags,
             pad_a,
             pad_b,
-        ] = unpack(format, io)
+            loop,
+            book,
+        ] = reader.unpack(_WAVETABLE)
 
         assert pad_a == 0
         assert pad_b == 0
 
         if table.type == AL_ADPCM_WAVE:
-            [loop, book] = unpack(f">2{u32}", io)
-
             if loop:
                 table.loop = reader.register(loop, ALADPCMloop)
             if book:
                 table.book = reader.register(book, ALADPCMBook)
         elif table.type == AL_RAW16_WAVE:
-            [table.loop] = unpack(f">{u32}", io)
+            table.loop = loop
             assert False
             # TODO: parse wave stuff
         else:
@@ -185,7 +198,7 @@ class ALWaveTable:
         pass
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALSound:
     envelope: U32
     keyMap: U32
@@ -195,8 +208,7 @@ class ALSound:
     flags: U8
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
-        format = f">{u32}{u32}{u32}{u8}{u8}{u8}"
+    def unpack(reader: Reader):
         sound = ALSound()
         [
             sound.envelope,
@@ -205,7 +217,7 @@ class ALSound:
             sound.samplePan,
             sound.sampleVolume,
             sound.flags,
-        ] = unpack(format, io)
+        ] = reader.unpack(_SOUND)
 
         reader.register(sound.wavetable, ALWaveTable)
         reader.register(sound.envelope, ALEnvelope)
@@ -213,7 +225,7 @@ class ALSound:
         return sound
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALInstrument:
     volume: U8  # * overall volume for this instrument   */
     pan: ALPan  # * 0 = hard left, 127 = hard right      */
@@ -229,13 +241,12 @@ class ALInstrument:
     vibDelay: U8  # * the delay for the tremelo osc        */
     bendRange: S16  # * pitch bend range in cents            */
     soundCount: S16  # * number of sounds in this array       */
-    soundArray: List[U32]
+    soundArray: array[U32]
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader) -> ALInstrument:
+    def unpack(reader: Reader) -> ALInstrument:
         inst = ALInstrument()
 
-        format = f">12{u8}{s16}{s16}"
         [
             inst.volume,
             inst.pan,
@@ -251,188 +262,211 @@ class ALInstrument:
             inst.vibDelay,
             inst.bendRange,
             inst.soundCount,
-        ] = unpack(format, io)
+        ] = reader.unpack(_INSTRUMENT)
 
-        format = f">{inst.soundCount}{s32}"
-        inst.soundArray = list(unpack(format, io))
+        inst.soundArray = reader.unpack_array(s32, inst.soundCount)
 
+        register = reader.register
         for offset in inst.soundArray:
-            reader.register(offset, ALSound)
+            register(offset, ALSound)
 
         return inst
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALBank:
     instCount: S16  # /* number of programs in this bank */
     flags: U8
     pad: U8
     sampleRate: S32  # /* e.g. 44100, 22050, etc...       */
     percussion: U32  # /* default percussion for GM       */
-    instArray: List[U32]  # /* ARRAY of instruments            */
+    instArray: array[U32]  # /* ARRAY of instruments            */
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
+    def unpack(reader: Reader):
         bank = ALBank()
 
-        format = f">{s16}{u8}{u8}{s32}"
         [
             bank.instCount,
             bank.flags,
             bank.pad,
             bank.sampleRate,
-        ] = unpack(format, io)
+        ] = reader.unpack(_BANK)
 
-        format = f">{s32}{bank.instCount}{s32}"
-        offsets = unpack(format, io)
+        offsets = reader.unpack_array(s32, bank.instCount + 1)
 
         bank.percussion = offsets[0]
         if bank.percussion != 0:
             reader.register(bank.percussion, ALInstrument)
 
-        bank.instArray = list(offsets[1:])
-        for offset in bank.instArray:
-            if offset != 0:
-                reader.register(offset, ALInstrument)
+        bank.instArray = offsets[1:]
+        # Unused program slots are null, filter(None, ...) skips them in C
+        register = reader.register
+        for offset in filter(None, bank.instArray):
+            register(offset, ALInstrument)
 
         return bank
 
 
-@dataclass(init=False)
+@dataclass(init=False, slots=True)
 class ALBankFile:
     revision: S16
     bankCount: S16
-    bankArray: List[U32]
+    bankArray: array[U32]
 
     @staticmethod
-    def unpack(io: BytesIO, reader: Reader):
+    def unpack(reader: Reader):
         file = ALBankFile()
 
-        format = f">{s16}{s16}"
-        [file.revision, file.bankCount] = unpack(format, io)
-
-        format = f">{file.bankCount}{s32}"
-        file.bankArray = list(unpack(format, io))
+        [file.revision, file.bankCount] = reader.unpack(_BANK_FILE)
+        file.bankArray = reader.unpack_array(s32, file.bankCount)
 
+        register = reader.register
         for bank in file.bankArray:
-            reader.register(bank, ALBank)
+            register(bank, ALBank)
 
         return file
 
 
-@dataclass()
+@dataclass(slots=True)
 class ReaderItem:
     offset: int
     type: type
     size: int = -1
-    value = None
+    value: Any = None
+    # Shared by every register() call for this offset
+    pointer: Pointer | None = None
 
 
 @dataclass(init=False)
 class Reader:
-    io: BytesIO
-    items: List[ReaderItem]
+    buf: memoryview
+    pos: int
+    items: Dict[int, ReaderItem]
+    by_type: DefaultDict[type, List[ReaderItem]]
+    pending: Deque[ReaderItem]
 
     def __init__(self, buffer: bytes) -> None:
-        self.io = BytesIO(buffer)
-        self.items = []
-        self.changed = False
+        self.buf = memoryview(buffer).toreadonly()
+        self.pos = 0
+        self.items = {}
+        self.by_type = defaultdict(list)
+        self.pending = deque()
+
+    def __enter__(self) -> Reader:
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # Releases the view so the underlying buffer (e.g. an mmap) can close
+        self.buf.release()
+
+    def seek(self, offset: int):
+        self.pos = offset
+
+    def unpack(self, fmt: struct.Struct) -> Tuple[Any, ...]:
+        values = fmt.unpack_from(self.buf, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def unpack_array(self, typecode: str, count: int) -> array:
+        values = array(typecode)
+        end = self.pos + count * values.itemsize
+        values.frombytes(self.buf[self.pos : end])
+        assert len(values) == count
+        if sys.byteorder == "little":
+            values.byteswap()
+
+        self.pos = end
+        return values
 
     def register(self, offset: int, _type: type) -> Pointer | None:
-        for item in self.items:
-            if item.offset == offset:
-                if item.type is _type:
-                    return Pointer[_type](offset, self)
+        item = self.items.get(offset)
+        if item is not None:
+            if item.type is _type:
+                return item.pointer
 
-                raise Exception("offset already taken")
+            raise Exception("offset already taken")
 
-        self.items.append(ReaderItem(offset, _type))
-        self.changed = True
-        return Pointer[_type](offset, self)
+        item = ReaderItem(offset, _type)
+        item.pointer = Pointer[_type](offset, self, item)
+        self.items[offset] = item
+        self.by_type[_type].append(item)
+        self.pending.append(item)
+        return item.pointer
 
     def resolve(self):
-        while self.changed:
-            self.changed = False
-            for item in self.items:
-                if item.value is not None:
-                    pass
-
-                self.io.seek(item.offset, SEEK_SET)
+        while self.pending:
+            item = self.pending.popleft()
+            self.seek(item.offset)
 
-                unpack = getattr(item.type, "unpack", None)
-                if not callable(unpack):
-                    raise Exception(f"{item.type} does not have an unpack method")
-                item.value = unpack(self.io, self)
-                item.size = self.io.tell() - item.offset
+            unpack = getattr(item.type, "unpack", None)
+            if not callable(unpack):
+                raise Exception(f"{item.type} does not have an unpack method")
+            item.value = unpack(self)
+            item.size = self.pos - item.offset
 
     def print(self):
-        self.items.sort(key=lambda item: item.offset)
+        import rich.pretty
 
         offset = 0
-        self.io.seek(0)
-
-        for item in self.items:
-            aligned = math.ceil(offset / 8) * 8
-            if aligned:
-                align_size = aligned - offset
-                aligners = self.io.read(align_size)
-                assert aligners == b"\0" * align_size
+
+        for item in sorted(self.items.values(), key=lambda item: item.offset):
+            aligned = (offset + 7) & ~7
+            if aligned != offset:
+                assert not any(self.buf[offset:aligned])
                 offset = aligned
 
             if offset != item.offset:
                 print(f"\n/* 0x{offset:X} */")
                 print(f"Bytes")
-                rich.print(self.io.read(item.offset - offset))
+                rich.print(bytes(self.buf[offset : item.offset]))
                 offset = item.offset
 
             print(f"\n/* 0x{offset:X} */")
             rich.pretty.pprint(item.value)
             offset = item.offset + item.size
-            self.io.seek(offset)
 
-        trailing = self.io.read()
+        trailing = bytes(self.buf[offset:])
         if trailing:
             print(f"\n/* 0x{offset:X} */")
             rich.print(trailing)
 
     def determine_alignments(self):
-        types = []
-
-        for item in self.items:
-            if not item.type in types:
-                types.append(item.type)
-
-        for type in types:
+        minAlignments: Dict[type, int] = {}
 
-            minAlignment = 16
-            for item in self.items:
-                if item.type != type:
-                    continue
-
-                alignment = t = bin(item.offset)[::-1].find("1")
-                minAlignment = min(alignment, minAlignment)
+        for item in self.items.values():
+            alignment = 16
+            if item.offset != 0:
+                # Count trailing zero bits
+                alignment = (item.offset & -item.offset).bit_length() - 1
+            minAlignments[item.type] = min(alignment, minAlignments.get(item.type, 16))
 
+        for type, minAlignment in minAlignments.items():
             print(f"{type}: {minAlignment}")
 
     def get(self, offset: int):
-        for item in self.items:
-            if offset == item.offset:
-                return item.value
+        item = self.items.get(offset)
+        if item is None:
+            return None
 
-        return None
+        return item.value
 
     def all(self, _type: type) -> List[Any]:
-        out: List[Any] = []
-        for item in self.items:
-            if _type == item.type:
-                out.append(item.value)
-
-        return out
+        return [item.value for item in self.by_type.get(_type, ())]
 
 
 def read_file(buffer: bytes) -> Reader:
     reader = Reader(buffer)
-    reader.register(0, ALBankFile)
-    reader.resolve()
+    try:
+        reader.register(0, ALBankFile)
+        reader.resolve()
+    except BaseException:
+        # The traceback keeps the reader alive, release its view now so the
+        # caller can still close the buffer without masking this error
+        reader.close()
+        raise
 
     return reader
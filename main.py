@@ -52,6 +52,25 @@ def ensure_dir(path: Path):
     os.mkdir(path)
 
 
+def copy_rom(src: Path, dst: Path):
+    # shutil already copies through sendfile/fcopyfile where the platform has
+    # it, so the remaining cost is copying a ROM that's already in place
+    if dst.exists():
+        src_stat = src.stat()
+        dst_stat = dst.stat()
+        if (
+            src_stat.st_size == dst_stat.st_size
+            and src_stat.st_mtime_ns == dst_stat.st_mtime_ns
+        ):
+            return
+
+    # Carry over the modification time for the check above, but not the mode:
+    # ROM dumps are often read-only, and a read-only copy couldn't be replaced
+    shutil.copyfile(src, dst)
+    src_stat = src.stat()
+    os.utime(dst, ns=(src_stat.st_atime_ns, src_stat.st_mtime_ns))
+
+
 def find_rom(basedir: Path, version: str):
 
     # Pad version with zeroes
@@ -74,7 +93,7 @@ if __name__ == "__main__":
         ensure_dir(path)
         rom_path = find_rom(args.dir, version)
         romPath = path / "baserom.z64"
-        shutil.copyfile(rom_path, romPath)
+        copy_rom(rom_path, romPath)
 
         os.chdir(path)
         create_config.main(romPath)
@@ -1,21 +1,23 @@
 #!/usr/bin/env python3
 
+import mmap
+import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from operator import attrgetter
 from pathlib import Path
-from typing import BinaryIO, List, NewType
-
-import rich.pretty
+from typing import BinaryIO, Dict, List, NewType
 
 from harmony.aifc import CommonChunk, FormAIFCChunk, SoundDataChunk, VadpcmCodesChunk
 from harmony.albankfile import ALBankFile, ALSound, ALWaveTable, read_file
 
 
-def convert_sound(wavetable: ALWaveTable, tbl_file: BinaryIO, path: Path):
+def convert_sound(wavetable: ALWaveTable, tbl: mmap.mmap, path: Path) -> bool:
     aifc_path = path / f"sound-{wavetable.base:X}.aifc"
     aiff_path = path / f"sound-{wavetable.base:X}.aiff"
 
-    tbl_file.seek(wavetable.base)
-    data = tbl_file.read(wavetable.len)
+    data = tbl[wavetable.base : wavetable.base + wavetable.len]
 
     aifc = FormAIFCChunk()
     aifc.chunks.append(
@@ -34,37 +36,88 @@ def convert_sound(wavetable: ALWaveTable, tbl_file: BinaryIO, path: Path):
 
     aifc.chunks.append(SoundDataChunk(0, 0, data))
 
-    with open(aifc_path, "wb") as file:
-        file.write(aifc.serialize())
+    aifc_path.write_bytes(aifc.serialize())
 
-    p = subprocess.run(["./aifc_decode", str(aifc_path), str(aiff_path)])
-    if p.returncode == 0:
-        aifc_path.unlink()
-    else:
-        rich.pretty.pprint(wavetable)
+    # Decode next to the output and rename it into place, so an interrupted
+    # run can't leave a partial .aiff that later runs take as up to date
+    part_path = path / f"sound-{wavetable.base:X}.aiff.part"
+    p = subprocess.run(["./aifc_decode", str(aifc_path), str(part_path)])
+    if p.returncode != 0:
+        part_path.unlink(missing_ok=True)
         aiff_path.unlink(missing_ok=True)
+        return False
+
+    os.replace(part_path, aiff_path)
+    aifc_path.unlink()
+    return True
+
+
+def is_up_to_date(output_path: Path, inputs_mtime: int) -> bool:
+    try:
+        return output_path.stat().st_mtime_ns > inputs_mtime
+    except FileNotFoundError:
+        return False
 
 
-def process_pair(ctl_file: BinaryIO, tbl_file: BinaryIO, path: Path):
+def process_pair(
+    ctl_file: BinaryIO, tbl_file: BinaryIO, path: Path, force_rebuild: bool = False
+):
     if not path.exists():
         path.mkdir(parents=True, exist_ok=True)
 
-    reader = read_file(ctl_file.read())
+    # Parsed values don't refer back into the CTL data, so the mapping can be
+    # closed as soon as the reader is done with it
+    with mmap.mmap(ctl_file.fileno(), 0, access=mmap.ACCESS_READ) as ctl:
+        with read_file(ctl) as reader:
+            all_wave_tables = reader.all(ALWaveTable)
+
+    # Several wavetable records can point at the same sample data, only
+    # convert each sample once. Output files are named after the base, so
+    # that's also what has to be unique. Keep the longest record for each
+    # base, a shorter one would cut the sample off
+    wave_tables_by_base: Dict[int, ALWaveTable] = {}
+    for wave_table in all_wave_tables:
+        kept = wave_tables_by_base.get(wave_table.base)
+        if kept is None or wave_table.len > kept.len:
+            wave_tables_by_base[wave_table.base] = wave_table
 
     wave_tables: List[ALWaveTable]
-    wave_tables = reader.all(ALWaveTable)
+    wave_tables = sorted(wave_tables_by_base.values(), key=attrgetter("base"))
 
-    wave_tables.sort(key=lambda table: table.base)
+    # Outputs written after both inputs were last modified are up to date
+    if not force_rebuild:
+        inputs_mtime = max(
+            os.fstat(ctl_file.fileno()).st_mtime_ns,
+            os.fstat(tbl_file.fileno()).st_mtime_ns,
+        )
+        wave_tables = [
+            wave_table
+            for wave_table in wave_tables
+            if not is_up_to_date(path / f"sound-{wave_table.base:X}.aiff", inputs_mtime)
+        ]
+
+    # Each conversion spends its time waiting on aifc_decode, which doesn't
+    # hold the GIL, so threads are enough to keep one decoder per core busy
+    with mmap.mmap(
+        tbl_file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as tbl, ThreadPoolExecutor(os.cpu_count()) as executor:
+        converted = executor.map(
+            partial(convert_sound, tbl=tbl, path=path), wave_tables
+        )
+        for wave_table, ok in zip(wave_tables, converted):
+            if not ok:
+                import rich.pretty
 
-    for wave_table in wave_tables:
-        convert_sound(wave_table, tbl_file, path)
+                rich.pretty.pprint(wave_table)
 
 
 if __name__ == "__main__":
-    ctl_file = open("ver/npfe/assets/music-2.bin", "rb")
-    tbl_file = open("ver/npfe/assets/B04430.bin", "rb")
-    process_pair(ctl_file, tbl_file, Path(__file__).parent / "temp/sounds-2")
-
-    ctl_file = open("ver/npfe/assets/music-1.bin", "rb")
-    tbl_file = open("ver/npfe/assets/BB6940.bin", "rb")
-    process_pair(ctl_file, tbl_file, Path(__file__).parent / "temp/sounds")
+    with open("ver/npfe/assets/music-2.bin", "rb") as ctl_file, open(
+        "ver/npfe/assets/B04430.bin", "rb"
+    ) as tbl_file:
+        process_pair(ctl_file, tbl_file, Path(__file__).parent / "temp/sounds-2")
+
+    with open("ver/npfe/assets/music-1.bin", "rb") as ctl_file, open(
+        "ver/npfe/assets/BB6940.bin", "rb"
+    ) as tbl_file:
+        process_pair(ctl_file, tbl_file, Path(__file__).parent / "temp/sounds")
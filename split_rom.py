@@ -1,19 +1,26 @@
+from __future__ import annotations
+
 import math
+import struct
 from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
 
-import bytechomp as bytechomp
 import ruamel.yaml
-from bytechomp.datatypes import U32
 from ruamel.yaml.scalarint import HexCapsInt
 
+if TYPE_CHECKING:
+    from bytechomp.datatypes import U32
+
 
-@dataclass
+@dataclass(slots=True)
 class BinarySegment:
     rom_start: int
     rom_end: int
+    name: str = ""
 
 
-@dataclass
+@dataclass(slots=True)
 class OverlaySegment:
     rom_start: U32  # Starting offset of segment ROM
     rom_end: U32  # Ending offset of segment ROM
@@ -24,18 +31,17 @@ class OverlaySegment:
     data_end: U32  # Ending address of DRAM of data attribute
     bss_start: U32  # Starting address of DRAM of bss attribute
     bss_end: U32  # Ending address of DRAM of bss attribute
+    name: str = ""
 
     def bss_size(self):
         return self.bss_end - self.bss_start
 
 
-def read_overlay(data: bytes) -> OverlaySegment:
-    reader = bytechomp.Reader[OverlaySegment](
-        byte_order=bytechomp.ByteOrder.BIG
-    ).allocate()
-    reader.feed(data)
-    assert reader.is_complete()
-    return reader.build()
+_OVERLAY = struct.Struct(">9I")
+
+
+def read_overlay(data: bytes, offset: int = 0) -> OverlaySegment:
+    return OverlaySegment(*_OVERLAY.unpack_from(data, offset))
 
 
 def compact_list(*args) -> ruamel.yaml.CommentedSeq:
@@ -150,18 +156,18 @@ def split(data: bytes, version: str):
         raise Exception("Unknown version")
 
     overlays: list[OverlaySegment] = []
-    overlay = read_overlay(data[pos : pos + 0x80])
+    overlay = read_overlay(data, pos)
     overlay.name = "second"
     overlays.append(overlay)
 
     listStart = overlay.rom_start + (overlay.data_start - overlay.ram_start)
-    for i in range(30):
-        overlay = read_overlay(data[listStart:])
-        overlay.name = f"overlay-{i}-{listStart:X}"
-        if i in overlay_names:
-            overlay.name = overlay_names[i]
+    listEnd = listStart + 30 * _OVERLAY.size
+    for i, fields in enumerate(_OVERLAY.iter_unpack(data[listStart:listEnd])):
+        overlay = OverlaySegment(*fields)
+        overlay.name = overlay_names.get(
+            i, f"overlay-{i}-{listStart + i * _OVERLAY.size:X}"
+        )
         overlays.append(overlay)
-        listStart += 9 * 4
 
     if version == "npfe":
         overlays.append(loadOverlay(0x13C780, 0x801B0310, 0x26530))
@@ -232,50 +238,44 @@ def split(data: bytes, version: str):
             c.yaml_set_start_comment("TODO: find overlay properties")
             segments.append(c)
 
-    file = open("out.html", "w")
-    file.write('<body style="font-family: Inter, sans-serif">')
+    parts: list[str] = []
+    parts.append('<body style="font-family: Inter, sans-serif">')
 
     lastPos = 0
-    file.write(
+    parts.append(
         '<div style="display: flex; align-items: stretch; height: 16px; background: #f8fafc; border: 1px solid #cbd5e1; margin-bottom: 4px;">'
     )
     for i, overlay in enumerate(overlays):
         if overlay.rom_start != lastPos:
-            file.write(f'<div style=" flex:{overlay.rom_start - lastPos}"></div>')
-        file.write(
+            parts.append(f'<div style=" flex:{overlay.rom_start - lastPos}"></div>')
+        parts.append(
             f'<div style="background: #06b6d4; flex:{overlay.rom_end - overlay.rom_start}"></div>'
         )
         lastPos = overlay.rom_end
 
     if lastPos != len(data):
-        file.write(f'<div style=" flex:{len(data) - lastPos}"></div>')
+        parts.append(f'<div style=" flex:{len(data) - lastPos}"></div>')
 
-    file.write("</div>")
+    parts.append("</div>")
 
-    file.write("<hr/>\n")
+    parts.append("<hr/>\n")
 
     for overlay in overlays:
         if not hasattr(overlay, "ram_start"):
             continue
 
-        file.write(
+        parts.append(
             f'<h2 style="font-size: 8px; font-family: inherit; margin: 0">0x{overlay.rom_start:X} {overlay.name}</h2>'
-        )
-        file.write(
             '<div style="display: flex; align-items: stretch; height: 16px; background: #f8fafc; border: 1px solid #cbd5e1; margin-bottom: 4px;">'
-        )
-        file.write(f'<div style="flex:{overlay.ram_start - 0x80000000}"></div>')
-        file.write(
+            f'<div style="flex:{overlay.ram_start - 0x80000000}"></div>'
             f'<div style="background: #06b6d4; flex:{overlay.text_end - overlay.ram_start}"></div>'
-        )
-        file.write(
             f'<div style="background: #67e8f9; flex:{overlay.data_end - overlay.text_end}"></div>'
-        )
-        file.write(
             f'<div style="background: #a5f3fc; flex:{overlay.bss_end - overlay.bss_start}"></div>'
+            f'<div style="flex: {0x80400000 - overlay.bss_end}"></div>'
+            "</div>"
         )
-        file.write(f'<div style="flex: {0x80400000 - overlay.bss_end}"></div>')
-        file.write("</div>")
-    file.write("</body>")
+    parts.append("</body>")
+
+    Path("out.html").write_text("".join(parts))
 
     return segments